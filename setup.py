@@ -11,12 +11,18 @@ filepath = os.path.dirname(__file__)
 
 # Define macros for cython
 macros = []
+
+# No -march or /arch flags: wheels must run on any CPU of their platform, and
+# the vector kernels in stlfile.c are selected at runtime instead. Loop
+# unrolling and LTO were measured to be neutral to slightly slower.
+extra_link_args = []
 if os.name == "nt":  # windows
-    extra_compile_args = ["/O2", "/w", "/GS"]
+    extra_compile_args = ["/O2", "/w", "/GS", "/openmp"]
 elif os.name == "posix":  # linux org mac os
     if sys.platform == "linux":
-        extra_compile_args = ["-std=gnu++11", "-O3", "-w"]
-    else:  # probably mac os
+        extra_compile_args = ["-std=gnu++11", "-O3", "-w", "-fopenmp"]
+        extra_link_args = ["-fopenmp"]
+    else:  # probably mac os, where the system compiler lacks OpenMP
         extra_compile_args = ["-O3", "-w"]
 else:
     raise Exception(f"Unsupported OS {os.name}")
@@ -65,10 +71,12 @@ setup(
                 "stl_reader._stlfile_wrapper",
                 [
                     "stl_reader/stlfile.c",
+                    "stl_reader/stlascii.c",
                     "stl_reader/_stlfile_wrapper.pyx",
                 ],
                 language="c",
                 extra_compile_args=extra_compile_args,
+                extra_link_args=extra_link_args,
                 define_macros=macros,
                 include_dirs=[np.get_include()],
             )
@@ -1 +1 @@
-from stl_reader.reader import read, read_as_mesh  # noqa: F401
+from stl_reader.reader import read, read_as_mesh, read_triangles  # noqa: F401
@@ -2,6 +2,7 @@
 # cython: boundscheck=False
 # cython: wraparound=False
 # cython: cdivision=True
+# cython: initializedcheck=False
 
 # Import the Python-level symbols of numpy
 import numpy as np
@@ -13,80 +14,181 @@ cimport numpy as np
 np.import_array()
 
 cimport cython
-from libc.stdio cimport FILE, fclose, fopen
+from libc.stdint cimport INT32_MAX, uint8_t
 from libc.stdlib cimport free, malloc
 
 
 cdef extern from "stlfile.h":
+    enum: STL_TRI_STRIDE
+    enum: STL_TRI_VERTS
     ctypedef unsigned int vertex_t
     ctypedef unsigned int triangle_t
-    int loadstl(FILE *fp, char *comment, float **vertp, vertex_t *nvertp, vertex_t **trip, unsigned short **attrp, triangle_t *ntrip)
+    ctypedef struct stl_mmap_t:
+        const uint8_t *data
+        size_t size
+    int stl_mmap_open(const char *filename, stl_mmap_t *map)
+    void stl_mmap_close(stl_mmap_t *map)
+    int stl_triangles(const uint8_t *buf, size_t size, const uint8_t **tripp, triangle_t *ntrip, uint8_t **binp)
+    int stl_merge(const uint8_t *tri, triangle_t ntris, float *vertp, vertex_t *nvertp, void *tris, size_t index_size, int nthreads) nogil
 
 
-cdef class ArrayWrapper:
-    cdef void* data_ptr
-    cdef int size
-    cdef int dtype
+cdef class MappedFile:
+    cdef stl_mmap_t stl_map
 
-    cdef set_data(self, int size, void* data_ptr, int dtype):
-        """ Constructor for the class.
-        Mallocs a memory buffer of size (n*sizeof(int)) and sets up
-        the numpy array.
+    def __cinit__(self, str filename):
+        """ Memory map a file for reading.
         Parameters:
         -----------
-        n -- Length of the array.
+        filename -- Path to the file.
         Data attributes:
         ----------------
-        data -- Pointer to an integer array.
-        alloc -- Size of the data buffer allocated.
+        stl_map -- Read-only mapping of the entire file, kept for as long
+        as this object or any array based on it is alive.
         """
-        self.data_ptr = data_ptr
-        self.size = size
-        self.dtype = dtype
+        if stl_mmap_open(filename.encode('utf-8'), &self.stl_map) != 0:
+            raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
+
+    def __dealloc__(self):
+        """ Unmaps the file. """
+        stl_mmap_close(&self.stl_map)
+
+
+cdef class ArrayWrapper:
+    cdef void* data_ptr
 
-    def __array__(self):
-        cdef np.npy_intp shape[1]
-        shape[0] = <np.npy_intp> self.size
-        ndarray = np.PyArray_SimpleNewFromData(1, shape, self.dtype, self.data_ptr)
-        return ndarray
+    cdef set_data(self, void* data_ptr):
+        """ Take ownership of a malloc'ed buffer.
+        Parameters:
+        -----------
+        data_ptr -- Pointer to the buffer, freed along with this object.
+        """
+        self.data_ptr = data_ptr
 
     def __dealloc__(self):
         """ Frees the array. """
         free(<void*>self.data_ptr)
 
 
-def get_stl_data(str filename):
+cdef class STLBuffer:
+    cdef const uint8_t *trip
+    cdef triangle_t ntrip
+    cdef object owner
+
+    cdef set_triangles(self, const uint8_t *trip, triangle_t ntrip, object owner):
+        """ Point at the triangle records of a STL file.
+        Parameters:
+        -----------
+        trip -- Pointer to the first triangle record.
+        ntrip -- Number of triangle records.
+        owner -- Object owning the memory of the records, kept alive along
+        with this object.
+        """
+        self.trip = trip
+        self.ntrip = ntrip
+        self.owner = owner
+
+    @property
+    def __array_interface__(self):
+        """ Read-only view of the vertices of each triangle record in place,
+        skipping the leading normal and trailing attribute. """
+        return {
+            "version": 3,
+            "shape": (self.ntrip, 3, 3),
+            # the file is always little endian
+            "typestr": "<f4",
+            "strides": (STL_TRI_STRIDE, 12, 4),
+            "data": (<size_t> (self.trip + STL_TRI_VERTS), True),
+        }
+
+
+def get_stl_data(str filename, index_dtype=np.uint32, int threads=1):
+    """ Merge the vertices of a STL file into points and triangle indices.
+    Parameters:
+    -----------
+    filename -- Path to the file.
+    index_dtype -- Type of the indices, uint32, int32 or int64. None picks
+    int32 when every index fits and int64 otherwise, matching the index
+    types VTK cell arrays are stored in.
+    threads -- Number of threads merging the vertices. Threads are only
+    started when this is more than 1, after which forked child processes
+    must read with a single thread.
+    """
     cdef:
-        FILE *fp
-        char comment[80]
-        float *vertp
-        vertex_t nverts
-        vertex_t *trip
-        unsigned short *attrp
+        MappedFile mapped
+        const uint8_t *trip
+        uint8_t *bin
         triangle_t ntrip
-        np.ndarray verts_arr, tri_arr, attr_arr
+        vertex_t nverts
+        np.npy_intp shape[2]
+        np.ndarray points, indices
+        np.dtype index_type
+        size_t index_size
         int out
 
-    fp = fopen(filename.encode('utf-8'), "rb")
-    if fp is NULL:
-        raise FileNotFoundError(2, "No such file or directory: '%s'" % filename)
+    # checked before anything is allocated
+    if index_dtype is not None:
+        index_type = np.dtype(index_dtype)
+        if index_type not in (np.uint32, np.int32, np.int64):
+            raise ValueError("index_dtype must be uint32, int32 or int64, not %s" % index_type)
+    if threads < 1:
+        raise ValueError("threads must be at least 1, not %d" % threads)
 
-    # Call the STL file loader
-    out = loadstl(fp, comment, &vertp, &nverts, &trip, &attrp, &ntrip)
-    fclose(fp)
-    if out == -2:
+    mapped = MappedFile(filename)
+    if stl_triangles(mapped.stl_map.data, mapped.stl_map.size, &trip, &ntrip, &bin) != 0:
         raise RuntimeError("Invalid or unrecognized STL file format.")
-    elif out != 0:
+
+    if index_dtype is None:
+        index_type = np.dtype(np.int32 if 3 * <size_t> ntrip <= INT32_MAX else np.int64)
+
+    try:
+        # the triangle count is known up front, so the outputs are allocated
+        # once without being initialized, with room for every vertex to be unique
+        shape[0] = 3 * <np.npy_intp> ntrip
+        shape[1] = 3
+        points = np.PyArray_EMPTY(2, shape, np.NPY_FLOAT32, 0)
+        shape[0] = ntrip
+        indices = np.PyArray_EMPTY(2, shape, index_type.num, 0)
+        index_size = index_type.itemsize
+
+        # merge vertices directly from the mapped file, writing indices of the
+        # requested width
+        with nogil:
+            out = stl_merge(
+                trip, ntrip, <float*> np.PyArray_DATA(points), &nverts,
+                np.PyArray_DATA(indices), index_size, threads
+            )
+    finally:
+        free(bin)
+    if out != 0:
         raise RuntimeError("Unable to load STL.")
+    if index_type == np.int32 and nverts > INT32_MAX:
+        raise ValueError("Too many vertices for int32 indices.")
+
+    # shrink to the merged vertices in place
+    points.resize((nverts, 3), refcheck=False)
+    return points, indices
 
-    # wrap the vertex array
-    point_array_wrapper = ArrayWrapper()
-    point_array_wrapper.set_data(nverts*3, <void*> vertp, np.NPY_FLOAT32)
-    points = np.array(point_array_wrapper).reshape(nverts, 3)
 
-    # wrap the vertex array
-    tri_array_wrapper = ArrayWrapper()
-    tri_array_wrapper.set_data(ntrip*3, <void*> trip, np.NPY_UINT32)
-    indices = np.array(tri_array_wrapper).reshape(ntrip, 3)
+def get_stl_triangles(str filename):
+    cdef:
+        MappedFile mapped
+        ArrayWrapper bin_wrapper
+        STLBuffer buffer
+        const uint8_t *trip
+        uint8_t *bin
+        triangle_t ntrip
 
-    return points, indices
+    mapped = MappedFile(filename)
+    if stl_triangles(mapped.stl_map.data, mapped.stl_map.size, &trip, &ntrip, &bin) != 0:
+        raise RuntimeError("Invalid or unrecognized STL file format.")
+
+    # ascii files are viewed through their binary conversion instead
+    owner = mapped
+    if bin is not NULL:
+        bin_wrapper = ArrayWrapper()
+        bin_wrapper.set_data(bin)
+        owner = bin_wrapper
+
+    buffer = STLBuffer()
+    buffer.set_triangles(trip, ntrip, owner)
+    return np.asarray(buffer)
@@ -3,6 +3,37 @@ import numpy as np
 from stl_reader import _stlfile_wrapper
 
 
+def _vtk_array(arr):
+    """Wrap a contiguous array as a VTK array without copying.
+
+    ``arr`` must be ``float32``, ``float64``, ``int32`` or ``int64``, and two
+    dimensional arrays are wrapped with one component per column. The VTK
+    array shares memory with ``arr`` and keeps a reference to it. This skips
+    the checks and conversions of ``numpy_to_vtk`` and ``numpy_to_idarr``,
+    which ``_polydata_from_faces`` has already done.
+
+    """
+    from vtkmodules.vtkCommonCore import (
+        vtkDoubleArray,
+        vtkFloatArray,
+        vtkTypeInt32Array,
+        vtkTypeInt64Array,
+    )
+
+    array_types = {
+        np.dtype(np.float32): vtkFloatArray,
+        np.dtype(np.float64): vtkDoubleArray,
+        np.dtype(np.int32): vtkTypeInt32Array,
+        np.dtype(np.int64): vtkTypeInt64Array,
+    }
+    vtk_arr = array_types[arr.dtype]()
+    if arr.ndim == 2:
+        vtk_arr.SetNumberOfComponents(arr.shape[1])
+    vtk_arr.SetVoidArray(arr, arr.size, 1)
+    vtk_arr._numpy_reference = arr
+    return vtk_arr
+
+
 def _polydata_from_faces(points, faces):
     """Generate a polydata from a faces array containing no padding and all triangles.
 
@@ -25,34 +56,56 @@ def _polydata_from_faces(points, faces):
         )
 
     from pyvista import ID_TYPE
-
-    try:
-        from pyvista.core.utilities import numpy_to_idarr
-    except ModuleNotFoundError:  # pragma: no cover
-        from pyvista.utilities.cells import numpy_to_idarr
+    from vtkmodules.vtkCommonCore import vtkPoints
     from vtkmodules.vtkCommonDataModel import vtkCellArray
 
     if faces.ndim != 2:
         raise ValueError("Expected a two dimensional face array.")
 
     pdata = pv.PolyData()
-    pdata.points = points
+    if points.dtype in (np.float32, np.float64):
+        # skip the validation of the ``points`` setter for the reader's output
+        vtk_points = vtkPoints()
+        vtk_points.SetData(_vtk_array(np.ascontiguousarray(points)))
+        pdata.SetPoints(vtk_points)
+    else:
+        pdata.points = points
+
+    # cell arrays store either 32 or 64 bit indices, so unsigned indices are
+    # reinterpreted as signed ones whenever every point index fits rather
+    # than widened to ``ID_TYPE``
+    if faces.dtype == np.uint32 and points.shape[0] <= np.iinfo(np.int32).max:
+        faces = faces.view(np.int32)
+    elif faces.dtype not in (np.int32, np.int64):
+        faces = faces.astype(ID_TYPE)
+    faces_flat = np.ascontiguousarray(faces).reshape(-1)
 
     carr = vtkCellArray()
-    offset = np.arange(0, faces.size + 1, faces.shape[1], dtype=ID_TYPE)
-    carr.SetData(numpy_to_idarr(offset, deep=True), numpy_to_idarr(faces, deep=True))
+    faces_vtk = _vtk_array(faces_flat)
+    try:
+        # VTK 9.1+ accepts a constant cell size rather than an offset array
+        # (which recent VTK versions store implicitly)
+        carr.SetData(faces.shape[1], faces_vtk)
+    except TypeError:  # pragma: no cover
+        offset = np.arange(0, faces.size + 1, faces.shape[1], dtype=faces.dtype)
+        carr.SetData(_vtk_array(offset), faces_vtk)
     pdata.SetPolys(carr)
     return pdata
 
 
-def read(filename):
+def read(filename, threads=1):
     """
-    Read a binary STL file and returns the vertices and points.
+    Read a binary or ASCII STL file and returns the vertices and points.
 
     Parameters
     ----------
     filename : str
-        The path to the binary STL file.
+        The path to the STL file.
+    threads : int, default: 1
+        Number of threads used to merge the vertices. No threads are
+        started unless this is more than 1. Child processes forked after a
+        multithreaded read must read with a single thread, since OpenMP
+        thread pools do not survive ``fork``.
 
     Returns
     -------
@@ -92,12 +145,53 @@ def read(filename):
            [9005998, 9005999, 9005995]], dtype=uint32)
 
     """
-    return _stlfile_wrapper.get_stl_data(filename)
+    return _stlfile_wrapper.get_stl_data(filename, threads=threads)
+
+
+def read_triangles(filename):
+    """
+    Read the triangles of a STL file without merging vertices.
+
+    For binary files, the returned array is a read-only view of the memory
+    mapped file, so no vertex data is copied. The file remains mapped for as
+    long as the array (or any view of it) is alive.
+
+    Parameters
+    ----------
+    filename : str
+        The path to the STL file.
+
+    Returns
+    -------
+    triangles : np.ndarray
+        ``(n, 3, 3)`` array of the X, Y, and Z coordinates of the three
+        vertices of each triangle in the STL file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the specified STL file does not exist.
+    RuntimeError
+        If the STL file is not valid or cannot be read.
+
+    Example
+    -------
+    >>> import stl_reader
+    >>> triangles = stl_reader.read_triangles("example.stl")
+    >>> triangles.shape
+    (1280000, 3, 3)
+    >>> triangles[0]
+    array([[-0.01671113,  0.5450843 , -0.8382146 ],
+           [ 0.01671113,  0.5450843 , -0.8382146 ],
+           [ 0.        ,  0.52573115, -0.8506509 ]], dtype=float32)
+
+    """
+    return _stlfile_wrapper.get_stl_triangles(filename)
 
 
-def read_as_mesh(filename):
+def read_as_mesh(filename, threads=1):
     """
-    Read a binary STL file and return it as a mesh.
+    Read a binary or ASCII STL file and return it as a mesh.
 
     This function uses the `get_stl_data` function, which is a wrapper
     of https://github.com/aki5/libstl, to read STL files.
@@ -105,7 +199,9 @@ def read_as_mesh(filename):
     Parameters
     ----------
     filename : str
-        The path to the binary STL file.
+        The path to the STL file.
+    threads : int, default: 1
+        Number of threads used to merge the vertices, see :func:`read`.
 
     Returns
     -------
@@ -138,5 +234,7 @@ def read_as_mesh(filename):
     Requires the ``pyvista`` library.
 
     """
-    vertices, indices = read(filename)
+    # indices are written as the int32 or int64 VTK stores them in, so they
+    # are never converted
+    vertices, indices = _stlfile_wrapper.get_stl_data(filename, index_dtype=None, threads=threads)
     return _polydata_from_faces(vertices, indices)
@@ -0,0 +1,237 @@
+/*
+Convert ASCII STL files into the binary STL format in memory, so that they
+can be loaded through the same path as binary files.
+
+Only the vertex lines are needed to build the mesh: the normals are ignored
+just like they are for binary files, and every three vertices form a
+triangle.
+*/
+
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "stlfile.h"
+
+// longest number handed to strtof
+#define MAX_NUMBER 64
+
+static const double powers_of_ten[] = {
+    1e0,  1e1,  1e2,  1e3,  1e4,  1e5,  1e6,  1e7,  1e8,  1e9,  1e10, 1e11,
+    1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22};
+
+static void put32(uint8_t *buf, uint32_t val) {
+  buf[0] = val & 0xff;
+  buf[1] = (val >> 8) & 0xff;
+  buf[2] = (val >> 16) & 0xff;
+  buf[3] = (val >> 24) & 0xff;
+}
+
+static int is_space(char c) {
+  return c == ' ' || c == '\t' || c == '\r' || c == '\n' || c == '\v' ||
+         c == '\f';
+}
+
+static int is_digit(char c) { return c >= '0' && c <= '9'; }
+
+static const char *skip_space(const char *p, const char *end) {
+  while (p < end && is_space(*p))
+    p++;
+  return p;
+}
+
+/*
+ * Parse the number at p, returning a pointer past it or NULL on failure.
+ *
+ * Up to 19 significant digits are accumulated exactly and scaled by an exact
+ * power of ten in double precision, which is within two double ulps of the
+ * decimal value. Rounding that to float gives the correctly rounded result
+ * unless it lies within a few ulps of a point halfway between two floats,
+ * in which case (and for anything unusual such as large exponents, inf or
+ * nan) the number is handed to strtof.
+ */
+static const char *parse_float(const char *p, const char *end, float *out) {
+  const char *start = p, *token_end;
+  char number[MAX_NUMBER];
+  uint64_t mant = 0, bits;
+  int ndigits = 0, nsig = 0, exp10 = 0, exp, neg = 0, eneg;
+  uint32_t low;
+  double val;
+  char *strtof_end;
+
+  if (p < end && (*p == '-' || *p == '+')) {
+    neg = *p == '-';
+    p++;
+  }
+  for (; p < end && is_digit(*p); p++, ndigits++) {
+    if (nsig < 19) {
+      mant = 10 * mant + (*p - '0');
+      nsig += mant != 0;
+    } else {
+      exp10++;
+    }
+  }
+  if (p < end && *p == '.') {
+    for (p++; p < end && is_digit(*p); p++, ndigits++) {
+      if (nsig < 19) {
+        mant = 10 * mant + (*p - '0');
+        nsig += mant != 0;
+        exp10--;
+      }
+    }
+  }
+  if (ndigits == 0)
+    goto slow;
+
+  if (p < end && (*p == 'e' || *p == 'E')) {
+    p++;
+    eneg = 0;
+    if (p < end && (*p == '-' || *p == '+')) {
+      eneg = *p == '-';
+      p++;
+    }
+    if (p == end || !is_digit(*p))
+      goto slow;
+    for (exp = 0; p < end && is_digit(*p); p++) {
+      if (exp < 1000)
+        exp = 10 * exp + (*p - '0');
+    }
+    exp10 += eneg ? -exp : exp;
+  }
+  if (p < end && !is_space(*p))
+    goto slow;
+  if (exp10 < -22 || exp10 > 22)
+    goto slow;
+
+  val = (double)mant;
+  val = exp10 < 0 ? val / powers_of_ten[-exp10] : val * powers_of_ten[exp10];
+
+  // float has 29 fewer mantissa bits than double, a halfway point between
+  // two floats has exactly the top one of these set
+  memcpy(&bits, &val, sizeof bits);
+  low = (uint32_t)(bits & ((1u << 29) - 1));
+  if (low - ((1u << 28) - 4) <= 8)
+    goto slow;
+
+  *out = (float)(neg ? -val : val);
+  return p;
+
+slow:
+  token_end = start;
+  while (token_end < end && !is_space(*token_end))
+    token_end++;
+  if (token_end == start || token_end - start >= MAX_NUMBER)
+    return NULL;
+
+  memcpy(number, start, token_end - start);
+  number[token_end - start] = '\0';
+  *out = strtof(number, &strtof_end);
+  if (strtof_end != number + (token_end - start))
+    return NULL;
+  return token_end;
+}
+
+// keywords other than vertex that may start a line
+static const char *const keywords[] = {"solid",   "facet",    "outer",
+                                       "endloop", "endfacet", "endsolid"};
+
+// case insensitive check for a keyword followed by whitespace or the end
+static int is_keyword(const char *p, const char *end, const char *keyword) {
+  size_t n = strlen(keyword), i;
+
+  if ((size_t)(end - p) < n)
+    return 0;
+  for (i = 0; i < n; i++) {
+    if ((p[i] | 0x20) != keyword[i])
+      return 0;
+  }
+  return p + n == end || is_space(p[n]);
+}
+
+static int is_other_keyword(const char *p, const char *end) {
+  size_t i;
+
+  for (i = 0; i < sizeof keywords / sizeof keywords[0]; i++) {
+    if (is_keyword(p, end, keywords[i]))
+      return 1;
+  }
+  return 0;
+}
+
+int stl_ascii_to_binary(const uint8_t *buf, size_t size, uint8_t **binp,
+                        size_t *binsizep) {
+  const char *p = (const char *)buf, *end = p + size, *line_end;
+  uint8_t *bin, *tri;
+  size_t cap, nverts, ntris;
+  float vert[3];
+  uint32_t bits;
+  int k, seen_end = 0;
+
+  // a facet takes well over 100 bytes of text
+  cap = size / 128 + 16;
+  bin = calloc(84 + STL_TRI_STRIDE * cap, 1);
+  if (bin == NULL)
+    return -1;
+
+  nverts = 0;
+  for (; p < end; p = line_end + (line_end < end)) {
+    line_end = memchr(p, '\n', end - p);
+    if (line_end == NULL)
+      line_end = end;
+
+    // only vertex lines are parsed, but every other line must still start
+    // with a keyword so that corrupt files (such as truncated binary files
+    // whose header starts with "solid") are rejected
+    p = skip_space(p, line_end);
+    if (p == line_end)
+      continue;
+    if (!is_keyword(p, line_end, "vertex")) {
+      if (!is_other_keyword(p, line_end))
+        goto exit_fail;
+      seen_end |= is_keyword(p, line_end, "endsolid");
+      continue;
+    }
+    p += 6;
+
+    for (k = 0; k < 3; k++) {
+      p = skip_space(p, line_end);
+      p = parse_float(p, line_end, vert + k);
+      if (p == NULL)
+        goto exit_fail;
+    }
+    if (skip_space(p, line_end) != line_end)
+      goto exit_fail;
+
+    ntris = nverts / 3;
+    if (ntris == cap) {
+      uint8_t *grown = realloc(bin, 84 + STL_TRI_STRIDE * 2 * cap);
+      if (grown == NULL)
+        goto exit_fail;
+      bin = grown;
+      memset(bin + 84 + STL_TRI_STRIDE * cap, 0, STL_TRI_STRIDE * cap);
+      cap *= 2;
+    }
+
+    // the normal and attribute of each record stay zero
+    tri = bin + 84 + STL_TRI_STRIDE * ntris + STL_TRI_VERTS + 12 * (nverts % 3);
+    for (k = 0; k < 3; k++) {
+      memcpy(&bits, vert + k, sizeof bits);
+      put32(tri + 4 * k, bits);
+    }
+    nverts++;
+  }
+
+  // a file without any facets must at least be terminated
+  if (nverts % 3 != 0 || nverts / 3 > UINT32_MAX || (nverts == 0 && !seen_end))
+    goto exit_fail;
+
+  ntris = nverts / 3;
+  put32(bin + 80, (uint32_t)ntris);
+  *binp = bin;
+  *binsizep = 84 + STL_TRI_STRIDE * ntris;
+  return 0;
+
+exit_fail:
+  free(bin);
+  return -1;
+}
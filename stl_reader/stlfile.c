@@ -22,7 +22,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 
 Also modified by Alex Kaszynski 2023 to check is the file is ASCII and the
-elimination of stderr.
+elimination of stderr, and to read from a memory mapped file rather than
+through stdio.
 
 */
 
@@ -31,6 +32,37 @@ elimination of stderr.
 #include <stdlib.h>
 #include <string.h>
 
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+// vector kernels are compiled for x86 regardless of the compiler flags and
+// selected at runtime based on what the CPU supports
+#if defined(__x86_64__) || defined(_M_X64) || defined(__i386__) ||             \
+    defined(_M_IX86)
+#define STL_X86
+#include <immintrin.h>
+#ifdef _MSC_VER
+#include <intrin.h>
+#define STL_TARGET(isa)
+#else
+#define STL_TARGET(isa) __attribute__((target(isa)))
+#endif
+#endif
+
+#if defined(__GNUC__) || defined(__clang__)
+#define STL_PREFETCH(addr) __builtin_prefetch(addr, 1)
+#elif defined(STL_X86)
+#define STL_PREFETCH(addr) _mm_prefetch((const char *)(addr), _MM_HINT_T0)
+#else
+#define STL_PREFETCH(addr)
+#endif
+
 #include "hash96.h"
 #include "stlfile.h"
 
@@ -40,8 +72,15 @@ elimination of stderr.
 
 typedef int STL_STATUS;
 
-static uint32_t get16(uint8_t *buf) {
-  return (uint32_t)buf[0] + ((uint32_t)buf[1] << 8);
+// triangles merged per tile, sized so that the tile hash table of
+// 4 * STL_TILE slots (256 KiB) stays in L2
+#define STL_TILE 16384
+
+// vertices hashed ahead of the one being merged into the global list
+#define MERGE_AHEAD 16
+
+static int is_space(uint8_t c) {
+  return c == ' ' || c == '\t' || c == '\r' || c == '\n';
 }
 
 static uint32_t get32(uint8_t *buf) {
@@ -49,13 +88,38 @@ static uint32_t get32(uint8_t *buf) {
          ((uint32_t)buf[3] << 24);
 }
 
+// load the nine little endian vertex coordinates of a triangle record
+static void load_tri(const uint8_t *tri, uint32_t *vert) {
+#if defined(_WIN32) ||                                                         \
+    (defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_LITTLE_ENDIAN__)
+  memcpy(vert, tri + STL_TRI_VERTS, 9 * sizeof vert[0]);
+#else
+  int k;
+  for (k = 0; k < 9; k++)
+    vert[k] = get32((uint8_t *)tri + STL_TRI_VERTS + 4 * k);
+#endif
+}
+
+/*
+ * Vertices are merged by probing an open addressing hash table keyed on the
+ * raw 96 bits of each vertex, in triangle order. This emits indices directly
+ * in order of first appearance. Sorting packed vertex keys and running a
+ * unique pass instead needs a final scatter of every index back into
+ * triangle order, which benchmarked about 1.5x slower than the hash table on
+ * a 15 million triangle mesh, even when that mesh was merged through a single
+ * table far larger than cache. The triangles are now merged in tiles whose
+ * tables stay in L2 (see stl_merge), which only widens the gap.
+ *
+ * Slots hold just the vertex index, 4 bytes, and every probe compares the
+ * full vertex. Keeping the hash next to the index to skip most of those
+ * compares doubles the table and was about 8% slower, since with tiles in L2
+ * the table rather than the vertex reads is what misses cache.
+ */
 static vertex_t vertex(uint32_t *verts, vertex_t nverts, vertex_t *vht,
-                       vertex_t vhtcap, uint32_t *vert) {
+                       vertex_t vhtcap, uint32_t *vert, vertex_t hash) {
   vertex_t *vip, vi;
-  vertex_t hash;
   vertex_t i;
 
-  hash = final96(vert[0], vert[1], vert[2]);
   for (i = 0; i < vhtcap; i++) {
     vip = vht + ((hash + i) & (vhtcap - 1));
     vi = *vip;
@@ -70,129 +134,557 @@ static vertex_t vertex(uint32_t *verts, vertex_t nverts, vertex_t *vht,
   return ~(vertex_t)0;
 }
 
-STL_STATUS check_stl_format(FILE *fp) {
-  if (fp == NULL) {
-    printf("\n\tUnable to open the file");
-    return STL_INVALID;
+/*
+ * Vertex hashes are computed a block of triangles at a time ahead of the
+ * table probes, so that the hashing can use vector instructions. Hashes are
+ * stored per vertex slot, e.g. hashes[HASH_BLOCK + i] is the hash of the
+ * second vertex of the i-th triangle in the block.
+ */
+#define HASH_BLOCK 16
+
+static void hash_block_scalar(const uint8_t *tri, triangle_t n,
+                              uint32_t *hashes) {
+  triangle_t i, ti;
+  uint32_t vert[9];
+
+  for (i = 0; i < n; i++, tri += STL_TRI_STRIDE) {
+    load_tri(tri, vert);
+    for (ti = 0; ti < 3; ti++) {
+      hashes[ti * HASH_BLOCK + i] =
+          final96(vert[3 * ti], vert[3 * ti + 1], vert[3 * ti + 2]);
+    }
   }
+}
 
-  fseek(fp, 0, SEEK_END);
-  size_t fileSize = ftell(fp);
-  rewind(fp);
+#ifdef STL_X86
+#define rot32x16(x, k) _mm512_rol_epi32(x, k)
+
+STL_TARGET("avx512f")
+static __m512i final96x16(__m512i a, __m512i b, __m512i c) {
+  c = _mm512_sub_epi32(_mm512_xor_si512(c, b), rot32x16(b, 14));
+  a = _mm512_sub_epi32(_mm512_xor_si512(a, c), rot32x16(c, 11));
+  b = _mm512_sub_epi32(_mm512_xor_si512(b, a), rot32x16(a, 25));
+  c = _mm512_sub_epi32(_mm512_xor_si512(c, b), rot32x16(b, 16));
+  a = _mm512_sub_epi32(_mm512_xor_si512(a, c), rot32x16(c, 4));
+  b = _mm512_sub_epi32(_mm512_xor_si512(b, a), rot32x16(a, 14));
+  c = _mm512_sub_epi32(_mm512_xor_si512(c, b), rot32x16(b, 24));
+  return c;
+}
 
-  if (fileSize < 15) {
-    printf("\n\tThe STL file is not long enough (%zu bytes).\n", fileSize);
-    return STL_INVALID;
+// hash a full block, gathering one coordinate of 16 triangles at once
+STL_TARGET("avx512f")
+static void hash_block_avx512(const uint8_t *tri, uint32_t *hashes) {
+  const __m512i offsets = _mm512_setr_epi32(
+      0 * STL_TRI_STRIDE, 1 * STL_TRI_STRIDE, 2 * STL_TRI_STRIDE,
+      3 * STL_TRI_STRIDE, 4 * STL_TRI_STRIDE, 5 * STL_TRI_STRIDE,
+      6 * STL_TRI_STRIDE, 7 * STL_TRI_STRIDE, 8 * STL_TRI_STRIDE,
+      9 * STL_TRI_STRIDE, 10 * STL_TRI_STRIDE, 11 * STL_TRI_STRIDE,
+      12 * STL_TRI_STRIDE, 13 * STL_TRI_STRIDE, 14 * STL_TRI_STRIDE,
+      15 * STL_TRI_STRIDE);
+  triangle_t ti;
+
+  for (ti = 0; ti < 3; ti++) {
+    const uint8_t *vert = tri + STL_TRI_VERTS + 4 * 3 * ti;
+    __m512i x = _mm512_i32gather_epi32(offsets, vert, 1);
+    __m512i y = _mm512_i32gather_epi32(offsets, vert + 4, 1);
+    __m512i z = _mm512_i32gather_epi32(offsets, vert + 8, 1);
+    _mm512_storeu_si512(hashes + ti * HASH_BLOCK, final96x16(x, y, z));
   }
+}
+
+#define rot32x8(x, k)                                                          \
+  _mm256_or_si256(_mm256_slli_epi32(x, k), _mm256_srli_epi32(x, 32 - (k)))
+
+STL_TARGET("avx2")
+static __m256i final96x8(__m256i a, __m256i b, __m256i c) {
+  c = _mm256_sub_epi32(_mm256_xor_si256(c, b), rot32x8(b, 14));
+  a = _mm256_sub_epi32(_mm256_xor_si256(a, c), rot32x8(c, 11));
+  b = _mm256_sub_epi32(_mm256_xor_si256(b, a), rot32x8(a, 25));
+  c = _mm256_sub_epi32(_mm256_xor_si256(c, b), rot32x8(b, 16));
+  a = _mm256_sub_epi32(_mm256_xor_si256(a, c), rot32x8(c, 4));
+  b = _mm256_sub_epi32(_mm256_xor_si256(b, a), rot32x8(a, 14));
+  c = _mm256_sub_epi32(_mm256_xor_si256(c, b), rot32x8(b, 24));
+  return c;
+}
 
-  char sixBytes[7];
-  fread(sixBytes, 1, 6, fp);
-  sixBytes[6] = '\0';
+// hash a full block, gathering one coordinate of 8 triangles at once
+STL_TARGET("avx2")
+static void hash_block_avx2(const uint8_t *tri, uint32_t *hashes) {
+  const __m256i offsets = _mm256_setr_epi32(
+      0 * STL_TRI_STRIDE, 1 * STL_TRI_STRIDE, 2 * STL_TRI_STRIDE,
+      3 * STL_TRI_STRIDE, 4 * STL_TRI_STRIDE, 5 * STL_TRI_STRIDE,
+      6 * STL_TRI_STRIDE, 7 * STL_TRI_STRIDE);
+  triangle_t i, ti;
 
-  if (strcmp(sixBytes, "solid ") == 0) {
-    char line[100];
-    fgets(line, 100, fp);
-    if (strncmp(line, "facet ", 6) == 0) {
-      return STL_ASCII;
+  for (i = 0; i < HASH_BLOCK; i += 8, tri += 8 * STL_TRI_STRIDE) {
+    for (ti = 0; ti < 3; ti++) {
+      const int *vert = (const int *)(tri + STL_TRI_VERTS + 4 * 3 * ti);
+      __m256i x = _mm256_i32gather_epi32(vert, offsets, 1);
+      __m256i y = _mm256_i32gather_epi32(vert + 1, offsets, 1);
+      __m256i z = _mm256_i32gather_epi32(vert + 2, offsets, 1);
+      _mm256_storeu_si256((__m256i *)(hashes + ti * HASH_BLOCK + i),
+                          final96x8(x, y, z));
     }
-    rewind(fp);
   }
+}
 
-  if (fileSize < 84) {
-    printf("\n\tThe STL file is not long enough (%zu bytes).\n", fileSize);
-    return STL_INVALID;
+#ifdef _MSC_VER
+#define CPU_AVX2 0
+#define CPU_AVX512F 1
+
+// check cpuid and that the OS saves the ymm (and zmm) registers
+static int cpu_supports(int feature) {
+  int info[4];
+  unsigned long long xcr0, mask;
+
+  __cpuid(info, 0);
+  if (info[0] < 7)
+    return 0;
+  __cpuid(info, 1);
+  if (!(info[2] & (1 << 27)))
+    return 0;
+  xcr0 = _xgetbv(0);
+  mask = feature == CPU_AVX512F ? 0xe6 : 0x06;
+  if ((xcr0 & mask) != mask)
+    return 0;
+  __cpuidex(info, 7, 0);
+  return feature == CPU_AVX512F ? (info[1] >> 16) & 1 : (info[1] >> 5) & 1;
+}
+#define cpu_supports_avx2() cpu_supports(CPU_AVX2)
+#define cpu_supports_avx512f() cpu_supports(CPU_AVX512F)
+#else
+#define cpu_supports_avx2() __builtin_cpu_supports("avx2")
+#define cpu_supports_avx512f() __builtin_cpu_supports("avx512f")
+#endif
+#endif
+
+static void hash_block_default(const uint8_t *tri, uint32_t *hashes) {
+  hash_block_scalar(tri, HASH_BLOCK, hashes);
+}
+
+// hash a full block with the widest vector kernel the CPU supports
+static void (*hash_block)(const uint8_t *tri, uint32_t *hashes) = NULL;
+
+static void select_hash_block(void) {
+  if (hash_block != NULL)
+    return;
+#ifdef STL_X86
+  if (cpu_supports_avx512f()) {
+    hash_block = hash_block_avx512;
+    return;
   }
+  if (cpu_supports_avx2()) {
+    hash_block = hash_block_avx2;
+    return;
+  }
+#endif
+  hash_block = hash_block_default;
+}
 
-  fseek(fp, 80, SEEK_SET);
-  uint32_t nTriangles;
-  fread(&nTriangles, sizeof(nTriangles), 1, fp);
-  if (fileSize != (84 + (nTriangles * 50))) {
+// hash a full or partial block
+static void hash_triangles(const uint8_t *tri, triangle_t n, uint32_t *hashes) {
+  if (n == HASH_BLOCK)
+    hash_block(tri, hashes);
+  else
+    hash_block_scalar(tri, n, hashes);
+}
+
+STL_STATUS check_stl_format(const uint8_t *buf, size_t size) {
+  int i;
+
+  if (size < 15) {
+    printf("\n\tThe STL file is not long enough (%zu bytes).\n", size);
     return STL_INVALID;
   }
 
-  fseek(fp, 0, SEEK_SET);
-  return STL_BINARY;
+  // binary files may also start with "solid", so check their size first
+  if (size >= 84 &&
+      size == 84 + (size_t)get32((uint8_t *)buf + 80) * STL_TRI_STRIDE) {
+    return STL_BINARY;
+  }
+
+  // keywords are case insensitive, as in the ascii converter
+  for (i = 0; i < 5 && (buf[i] | 0x20) == "solid"[i]; i++)
+    ;
+  if (i == 5 && is_space(buf[5])) {
+    return STL_ASCII;
+  }
+
+  if (size < 84) {
+    printf("\n\tThe STL file is not long enough (%zu bytes).\n", size);
+  }
+  return STL_INVALID;
 }
 
-int loadstl(FILE *fp, char *comment, float **vertp, vertex_t *nvertp,
-            vertex_t **trip, uint16_t **attrp, triangle_t *ntrip) {
-  uint8_t buf[128];
-  triangle_t i, ti;
-  vertex_t *tris;
-  triangle_t ntris;
-  vertex_t *vht, vi, nverts, vhtcap;
-  uint32_t *verts;
-  uint16_t *attrs;
-
-  STL_STATUS format_status = check_stl_format(fp);
-  if (format_status == STL_INVALID) {
-    fprintf(stderr, "loadstl: Invalid or unrecognized STL file format\n");
-    return -2;
+int stl_mmap_open(const char *filename, stl_mmap_t *map) {
+  map->data = NULL;
+  map->size = 0;
+
+#ifdef _WIN32
+  wchar_t *wname;
+  int wlen;
+  LARGE_INTEGER fsize;
+
+  map->file = INVALID_HANDLE_VALUE;
+  map->mapping = NULL;
+
+  // filenames are passed as UTF-8
+  wlen = MultiByteToWideChar(CP_UTF8, 0, filename, -1, NULL, 0);
+  if (wlen == 0)
+    return -1;
+  wname = malloc(wlen * sizeof wname[0]);
+  MultiByteToWideChar(CP_UTF8, 0, filename, -1, wname, wlen);
+  map->file = CreateFileW(wname, GENERIC_READ, FILE_SHARE_READ, NULL,
+                          OPEN_EXISTING, FILE_FLAG_SEQUENTIAL_SCAN, NULL);
+  free(wname);
+  if (map->file == INVALID_HANDLE_VALUE)
+    return -1;
+
+  if (!GetFileSizeEx(map->file, &fsize)) {
+    stl_mmap_close(map);
+    return -1;
   }
+  map->size = (size_t)fsize.QuadPart;
 
-  // the comment and triangle count
-  if (fread(buf, 84, 1, fp) != 1) {
-    fprintf(stderr, "loadstl: short read at header\n");
+  // an empty file cannot be mapped
+  if (map->size == 0)
+    return 0;
+
+  map->mapping = CreateFileMappingA(map->file, NULL, PAGE_READONLY, 0, 0, NULL);
+  if (map->mapping == NULL) {
+    stl_mmap_close(map);
     return -1;
   }
+  map->data = MapViewOfFile(map->mapping, FILE_MAP_READ, 0, 0, 0);
+  if (map->data == NULL) {
+    stl_mmap_close(map);
+    return -1;
+  }
+#else
+  struct stat st;
+  void *data;
+  int fd;
+
+  fd = open(filename, O_RDONLY);
+  if (fd < 0)
+    return -1;
 
-  if (comment != NULL)
-    memcpy(comment, buf, 80);
+  if (fstat(fd, &st) != 0) {
+    close(fd);
+    return -1;
+  }
+  map->size = (size_t)st.st_size;
 
-  ntris = get32(buf + 80);
+  // an empty file cannot be mapped
+  if (map->size == 0) {
+    close(fd);
+    return 0;
+  }
 
-  tris = malloc(ntris * 3 * sizeof tris[0]);
-  attrs = malloc(ntris * sizeof attrs[0]);
-  verts = malloc(3 * ntris * 3 * sizeof verts[0]);
+  data = mmap(NULL, map->size, PROT_READ, MAP_PRIVATE, fd, 0);
+  // the mapping remains valid after the descriptor is closed
+  close(fd);
+  if (data == MAP_FAILED) {
+    map->size = 0;
+    return -1;
+  }
+
+  // the file is read front to back exactly once
+#ifdef MADV_SEQUENTIAL
+  madvise(data, map->size, MADV_SEQUENTIAL);
+#endif
+#ifdef MADV_WILLNEED
+  madvise(data, map->size, MADV_WILLNEED);
+#endif
+  map->data = data;
+#endif
+  return 0;
+}
+
+void stl_mmap_close(stl_mmap_t *map) {
+#ifdef _WIN32
+  if (map->data != NULL)
+    UnmapViewOfFile(map->data);
+  if (map->mapping != NULL)
+    CloseHandle(map->mapping);
+  if (map->file != INVALID_HANDLE_VALUE)
+    CloseHandle(map->file);
+  map->mapping = NULL;
+  map->file = INVALID_HANDLE_VALUE;
+#else
+  if (map->data != NULL)
+    munmap((void *)map->data, map->size);
+#endif
+  map->data = NULL;
+  map->size = 0;
+}
+
+int stl_triangles(const uint8_t *buf, size_t size, const uint8_t **tripp,
+                  triangle_t *ntrip, uint8_t **binp) {
+  size_t binsize;
+
+  *binp = NULL;
+  switch (check_stl_format(buf, size)) {
+  case STL_BINARY:
+    break;
+  case STL_ASCII:
+    // ascii files are converted to binary and loaded from there
+    if (stl_ascii_to_binary(buf, size, binp, &binsize) != 0) {
+      fprintf(stderr, "stl_triangles: Invalid ASCII STL file\n");
+      return -2;
+    }
+    buf = *binp;
+    break;
+  default:
+    fprintf(stderr, "stl_triangles: Invalid or unrecognized STL file format\n");
+    return -2;
+  }
+
+  *tripp = buf + 84;
+  *ntrip = get32((uint8_t *)buf + 80);
+  return 0;
+}
+
+/*
+ * Merge the vertices of triangles [0, ntris) of a tile into a tile local
+ * vertex list, writing tile local vertex indices to tris. vht is scratch space
+ * for the tile hash table of vhtcap slots.
+ */
+static int merge_tile(const uint8_t *tri, triangle_t ntris, uint32_t *verts,
+                      vertex_t *tris, vertex_t *vht, vertex_t vhtcap,
+                      vertex_t *nvertp) {
+  triangle_t i, ti, bi, nblock, nnext;
+  uint32_t hashes[2][3 * HASH_BLOCK], *cur, *next;
+  vertex_t vi, nverts;
 
-  vhtcap = nextpow2(4 * ntris);
-  vht = malloc(vhtcap * sizeof vht[0]);
   memset(vht, 0, vhtcap * sizeof vht[0]);
+  nverts = 0;
+  nblock = ntris < HASH_BLOCK ? ntris : HASH_BLOCK;
+  hash_triangles(tri, nblock, hashes[0]);
+  for (bi = 0; bi < ntris; bi += HASH_BLOCK) {
+    nblock = ntris - bi < HASH_BLOCK ? ntris - bi : HASH_BLOCK;
+    cur = hashes[(bi / HASH_BLOCK) & 1];
+    next = hashes[(bi / HASH_BLOCK + 1) & 1];
+
+    // hash the next block and prefetch its table slots while this one is
+    // merged, hiding the cache misses of the probes
+    if (bi + HASH_BLOCK < ntris) {
+      nnext = ntris - bi - HASH_BLOCK;
+      nnext = nnext < HASH_BLOCK ? nnext : HASH_BLOCK;
+      hash_triangles(tri + STL_TRI_STRIDE * HASH_BLOCK, nnext, next);
+      for (ti = 0; ti < 3; ti++) {
+        for (i = 0; i < nnext; i++)
+          STL_PREFETCH(vht + (next[ti * HASH_BLOCK + i] & (vhtcap - 1)));
+      }
+    }
+
+    for (i = bi; i < bi + nblock; i++, tri += STL_TRI_STRIDE) {
+      // only the vertices are read, the normal at tri[0..11] and the
+      // attribute at tri[48..49] are never touched
+      uint32_t tri_verts[9];
+      load_tri(tri, tri_verts);
+      for (ti = 0; ti < 3; ti++) {
+        uint32_t *vert = tri_verts + 3 * ti;
+        vi = vertex(verts, nverts, vht, vhtcap, vert,
+                    cur[ti * HASH_BLOCK + i - bi]);
+        if (vi == ~(uint32_t)0)
+          return -1;
+        if (vi == nverts) {
+          copy96(verts + 3 * nverts, vert);
+          nverts++;
+        } else {
+        }
+        tris[3 * i + ti] = vi;
+      }
+    }
+  }
+
+  *nvertp = nverts;
+  return 0;
+}
+
+/*
+ * Finish the tile local indices at [first, last), rewriting them through
+ * remap unless it is NULL. Wide indices start out as tile local ones packed
+ * at the start of the range and are widened in place back to front, so that
+ * none is overwritten before it is read.
+ */
+static void finish_indices(void *tris, int wide, size_t first, size_t last,
+                           const vertex_t *remap) {
+  size_t i;
+
+  if (wide) {
+    int64_t *dst = (int64_t *)tris + first;
+    vertex_t vi;
+
+    for (i = last - first; i-- > 0;) {
+      memcpy(&vi, (uint8_t *)dst + i * sizeof vi, sizeof vi);
+      dst[i] = remap == NULL ? vi : remap[vi];
+    }
+  } else if (remap != NULL) {
+    vertex_t *dst = (vertex_t *)tris;
+
+    for (i = first; i < last; i++)
+      dst[i] = remap[dst[i]];
+  }
+}
 
-  /* fprintf(stderr, "loadstl: number of triangles: %u, vhtcap %d\n", ntris,
-   * vhtcap); */
+/*
+ * Merge the tile local vertex lists in tile order, compacting verts in place
+ * and rewriting tile local indices to global ones. Since tiles are in
+ * triangle order the vertices end up in order of first appearance, exactly
+ * as if the triangles had been merged by a single tile.
+ */
+static int merge_tiles(uint32_t *verts, void *tris, int wide, triangle_t ntris,
+                       triangle_t tile, int ntiles, const vertex_t *tile_nverts,
+                       int nthreads, vertex_t *nvertp) {
+  vertex_t *remap, *vht, vi, nverts, vhtcap, k;
+  size_t nunique, pos, *tile_first;
+  int t;
+
+  nunique = 0;
+  for (t = 0; t < ntiles; t++)
+    nunique += tile_nverts[t];
+
+  // the table is at most half full while that fits in a vertex_t, beyond
+  // which the largest power of two table is used, at most 3/4 full like the
+  // tile tables. That holds the soup of as many triangles (3 << 29 vertices)
+  // as a single table of 4 * ntris slots could.
+  if (nunique > (size_t)3 << 29)
+    return -1;
 
+  remap = malloc(nunique * sizeof remap[0]);
+  tile_first = calloc(ntiles, sizeof tile_first[0]);
+  vhtcap = 2 * nunique <= (size_t)1 << 31 ? nextpow2((vertex_t)(2 * nunique))
+                                          : (vertex_t)1 << 31;
+  vht = calloc(vhtcap, sizeof vht[0]);
+  if (remap == NULL || tile_first == NULL || vht == NULL) {
+    free(remap);
+    free(tile_first);
+    free(vht);
+    return -1;
+  }
+
+  // each source vertex is at or after its destination, so the tile vertex
+  // lists are compacted in place
   nverts = 0;
-  for (i = 0; i < ntris; i++) {
-    if (fread(buf, 50, 1, fp) != 1) {
-      fprintf(stderr, "loadstl: short read at triangle %d/%d\n", i, ntris);
-      goto exit_fail;
+  pos = 0;
+  for (t = 0; t < ntiles; t++) {
+    uint32_t *tile_verts = verts + 3 * (3 * (size_t)tile * t);
+    uint32_t ahead[MERGE_AHEAD];
+
+    for (k = 0; k < tile_nverts[t] && k < MERGE_AHEAD; k++) {
+      uint32_t *vert = tile_verts + 3 * k;
+      ahead[k] = final96(vert[0], vert[1], vert[2]);
+      STL_PREFETCH(vht + (ahead[k] & (vhtcap - 1)));
     }
-    // there's a normal vector at buf[0..11] which we are ignoring
-    for (ti = 0; ti < 3; ti++) {
-      uint32_t vert[3];
-      vert[0] = get32(buf + 12 + 4 * 3 * ti);
-      vert[1] = get32(buf + 12 + 4 * 3 * ti + 4);
-      vert[2] = get32(buf + 12 + 4 * 3 * ti + 8);
-      vi = vertex(verts, nverts, vht, vhtcap, vert);
-      if (vi == ~(uint32_t)0) {
-        fprintf(stderr, "loadstl: vertex hash full at triangle %d/%d\n", i,
-                ntris);
-        goto exit_fail;
+    for (k = 0; k < tile_nverts[t]; k++) {
+      uint32_t *vert = tile_verts + 3 * k, hash = ahead[k % MERGE_AHEAD];
+      if (k + MERGE_AHEAD < tile_nverts[t]) {
+        uint32_t *next = vert + 3 * MERGE_AHEAD;
+        ahead[k % MERGE_AHEAD] = final96(next[0], next[1], next[2]);
+        STL_PREFETCH(vht + (ahead[k % MERGE_AHEAD] & (vhtcap - 1)));
+      }
+      vi = vertex(verts, nverts, vht, vhtcap, vert, hash);
+      if (vi == ~(vertex_t)0) {
+        free(remap);
+        free(tile_first);
+        free(vht);
+        return -1;
       }
       if (vi == nverts) {
         copy96(verts + 3 * nverts, vert);
         nverts++;
-      } else {
       }
-      tris[3 * i + ti] = vi;
+      remap[pos++] = vi;
     }
-    attrs[i] = get16(buf + 48);
   }
-
   free(vht);
-  verts = realloc(verts, nverts * 3 * sizeof verts[0]);
-  *vertp = (float *)verts;
+
+  // tile local indices are offset into the concatenated tile lists
+  for (t = 1; t < ntiles; t++)
+    tile_first[t] = tile_first[t - 1] + tile_nverts[t - 1];
+
+#pragma omp parallel for schedule(static)                                      \
+    num_threads(nthreads) if (nthreads > 1)
+  for (t = 0; t < ntiles; t++) {
+    size_t first = 3 * (size_t)tile * t;
+    size_t last = t == ntiles - 1 ? 3 * (size_t)ntris : first + 3 * tile;
+    finish_indices(tris, wide, first, last, remap + tile_first[t]);
+  }
+
+  free(remap);
+  free(tile_first);
   *nvertp = nverts;
-  *trip = tris;
-  *attrp = attrs;
-  *ntrip = ntris;
   return 0;
+}
 
-exit_fail:
-  free(vht);
-  free(verts);
-  free(tris);
-  free(attrs);
-  return -1;
+int stl_merge(const uint8_t *tri, triangle_t ntris, float *vertp,
+              vertex_t *nvertp, void *tris, size_t index_size, int nthreads) {
+  uint32_t *verts = (uint32_t *)vertp;
+  vertex_t *tile_nverts, vhtcap;
+  triangle_t tile;
+  int t, ntiles, status, wide = index_size == sizeof(int64_t);
+
+  if (index_size != sizeof(vertex_t) && !wide)
+    return -1;
+
+  select_hash_block();
+
+  // tiles small enough for their hash tables to stay in cache are merged
+  // independently and then into a single vertex list
+  tile = ntris < STL_TILE ? ntris : STL_TILE;
+  ntiles = tile == 0 ? 1 : (int)((ntris + tile - 1) / tile);
+  vhtcap = nextpow2(4 * tile);
+
+  tile_nverts = malloc(ntiles * sizeof tile_nverts[0]);
+  if (tile_nverts == NULL)
+    return -1;
+
+  /* fprintf(stderr, "stl_merge: number of triangles: %u, tiles %d\n", ntris,
+   * ntiles); */
+
+  status = 0;
+  // no threads are started unless asked for, since once an OpenMP thread
+  // pool exists, forked children hang in their first parallel region
+  if (nthreads > ntiles)
+    nthreads = ntiles;
+  if (nthreads < 1)
+    nthreads = 1;
+#pragma omp parallel reduction(| : status)                                     \
+    num_threads(nthreads) if (nthreads > 1)
+  {
+    // each thread reuses one tile table
+    vertex_t *vht = malloc(vhtcap * sizeof vht[0]);
+
+    status |= vht == NULL;
+#pragma omp for schedule(static)
+    for (t = 0; t < ntiles; t++) {
+      size_t first = (size_t)tile * t;
+      triangle_t n = t == ntiles - 1 ? ntris - (triangle_t)first : tile;
+      // wide indices are first written as tile local ones at the start of
+      // the tile range
+      vertex_t *tile_tris = wide ? (vertex_t *)((int64_t *)tris + 3 * first)
+                                 : (vertex_t *)tris + 3 * first;
+      if (vht != NULL)
+        status |= merge_tile(tri + STL_TRI_STRIDE * first, n, verts + 9 * first,
+                             tile_tris, vht, vhtcap, tile_nverts + t);
+    }
+    free(vht);
+  }
+
+  if (status == 0) {
+    if (ntiles == 1) {
+      finish_indices(tris, wide, 0, 3 * (size_t)ntris, NULL);
+      *nvertp = tile_nverts[0];
+    } else {
+      status = merge_tiles(verts, tris, wide, ntris, tile, ntiles, tile_nverts,
+                           nthreads, nvertp);
+    }
+  }
+  if (status != 0)
+    fprintf(stderr, "stl_merge: unable to merge vertices\n");
+
+  free(tile_nverts);
+  return status;
 }
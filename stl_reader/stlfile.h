@@ -23,9 +23,41 @@ THE SOFTWARE.
 
 */
 
+#include <stddef.h>
+#include <stdint.h>
+
+// binary triangle records are always 50 bytes: a normal, three vertices and
+// a 2 byte attribute, with the vertices starting at byte 12
+#define STL_TRI_STRIDE 50
+#define STL_TRI_VERTS 12
+
 typedef uint32_t vertex_t;
 typedef uint32_t triangle_t;
 typedef uint32_t halfedge_t;
 
-// load stl file, compute and return an indexed triangle mesh
-int loadstl(FILE *fp, char *comment, float **vertp, vertex_t *nvertp, vertex_t **trip, uint16_t **attrp, triangle_t *ntrip);
+// read-only mapping of an entire file
+typedef struct {
+	const uint8_t *data;
+	size_t size;
+#ifdef _WIN32
+	void *file;
+	void *mapping;
+#endif
+} stl_mmap_t;
+
+// map a file into memory, returns 0 on success
+int stl_mmap_open(const char *filename, stl_mmap_t *map);
+void stl_mmap_close(stl_mmap_t *map);
+
+// locate the 50 byte triangle records of a stl file in memory, ascii files
+// are first converted to a malloc'ed binary file returned in binp
+int stl_triangles(const uint8_t *buf, size_t size, const uint8_t **tripp, triangle_t *ntrip, uint8_t **binp);
+
+// convert an ascii stl file in memory to a malloc'ed binary stl file
+int stl_ascii_to_binary(const uint8_t *buf, size_t size, uint8_t **binp, size_t *binsizep);
+
+// merge the vertices of ntris triangle records into an indexed triangle mesh,
+// vertp must have room for 3 * ntris vertices and tris receives 3 * ntris
+// indices of index_size bytes, 4 for uint32 and 8 for int64 indices. Up to
+// nthreads threads are used, no threads are started if it is 1.
+int stl_merge(const uint8_t *tri, triangle_t ntris, float *vertp, vertex_t *nvertp, void *tris, size_t index_size, int nthreads);
@@ -1,4 +1,9 @@
 """Test stl_reader."""
+import multiprocessing
+import os
+import subprocess
+import sys
+
 import numpy as np
 import pytest
 import pyvista as pv
@@ -19,17 +24,39 @@ def stlfile_ascii(tmpdir):
     return str(filename)
 
 
+@pytest.fixture
+def stlfile_large(tmpdir):
+    # large enough to be merged in several tiles of 16384 triangles
+    filename = tmpdir.join("tmp.stl")
+    pv.Sphere(theta_resolution=300, phi_resolution=300).save(filename)
+    return str(filename)
+
+
 def test_read_binary(stlfile):
     pv_mesh = pv.read(stlfile)
 
     points, ind = stl_reader.read(stlfile)
+    assert points.flags["C_CONTIGUOUS"]
+    assert ind.flags["C_CONTIGUOUS"]
     assert np.allclose(pv_mesh.points, points)
     assert np.allclose(pv_mesh._connectivity_array, ind.ravel())
 
 
 def test_read_ascii(stlfile_ascii):
+    pv_mesh = pv.read(stlfile_ascii)
+
+    points, ind = stl_reader.read(stlfile_ascii)
+    assert np.array_equal(pv_mesh.points, points)
+    assert np.array_equal(pv_mesh._connectivity_array, ind.ravel())
+
+
+def test_read_ascii_invalid(tmpdir):
+    filename = str(tmpdir.join("tmp.stl"))
+    with open(filename, "w") as fid:
+        fid.write("solid bad\n facet normal 0 0 1\n  outer loop\n   vertex 0 0\n")
+
     with pytest.raises(RuntimeError):
-        stl_reader.read(stlfile_ascii)
+        stl_reader.read(filename)
 
 
 def test_read_as_mesh(stlfile):
@@ -37,3 +64,178 @@ def test_read_as_mesh(stlfile):
 
     stl_mesh = stl_reader.read_as_mesh(stlfile)
     assert pv_mesh == stl_mesh
+
+
+def test_read_missing(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        stl_reader.read(str(tmpdir.join("missing.stl")))
+
+
+def test_read_truncated(stlfile):
+    with open(stlfile, "rb") as fid:
+        data = fid.read()
+    with open(stlfile, "wb") as fid:
+        fid.write(data[:-25])
+
+    with pytest.raises(RuntimeError):
+        stl_reader.read(stlfile)
+
+
+@pytest.mark.parametrize("ntrunc", [7, 25, 50])
+def test_read_truncated_solid_header(stlfile, ntrunc):
+    # many exporters start binary headers with "solid", which must not make
+    # a truncated binary file pass as an empty ascii one
+    with open(stlfile, "rb") as fid:
+        data = fid.read()
+    header = b"solid part exported".ljust(80, b" ")
+    with open(stlfile, "wb") as fid:
+        fid.write(header + data[80:-ntrunc])
+
+    with pytest.raises(RuntimeError):
+        stl_reader.read(stlfile)
+
+
+def test_read_ascii_uppercase(stlfile_ascii):
+    points, ind = stl_reader.read(stlfile_ascii)
+    with open(stlfile_ascii) as fid:
+        text = fid.read()
+    with open(stlfile_ascii, "w") as fid:
+        fid.write(text.upper())
+
+    points_upper, ind_upper = stl_reader.read(stlfile_ascii)
+    assert np.array_equal(points_upper, points)
+    assert np.array_equal(ind_upper, ind)
+
+
+def test_read_ascii_empty(tmpdir):
+    filename = str(tmpdir.join("tmp.stl"))
+    with open(filename, "w") as fid:
+        fid.write("solid empty\nendsolid empty\n")
+
+    points, ind = stl_reader.read(filename)
+    assert points.shape == (0, 3)
+    assert ind.shape == (0, 3)
+
+
+def test_read_triangles(stlfile):
+    points, ind = stl_reader.read(stlfile)
+
+    triangles = stl_reader.read_triangles(stlfile)
+    assert triangles.shape == (ind.shape[0], 3, 3)
+    assert triangles.dtype == np.float32
+    assert not triangles.flags.writeable
+    assert np.array_equal(triangles, points[ind])
+
+    # the records are viewed in place through the array interface
+    assert triangles.base.__array_interface__["strides"] == (50, 12, 4)
+
+
+def test_read_triangles_ascii(stlfile_ascii):
+    points, ind = stl_reader.read(stlfile_ascii)
+
+    triangles = stl_reader.read_triangles(stlfile_ascii)
+    assert np.array_equal(triangles, points[ind])
+
+
+def test_read_partial_block(tmpdir):
+    # triangle count that is not a multiple of the hashing block size
+    filename = str(tmpdir.join("tmp.stl"))
+    pv.Plane(i_resolution=3, j_resolution=3).triangulate().save(filename)
+    pv_mesh = pv.read(filename)
+
+    points, ind = stl_reader.read(filename)
+    assert ind.shape == (18, 3)
+    assert np.allclose(pv_mesh.points, points)
+    assert np.allclose(pv_mesh._connectivity_array, ind.ravel())
+
+
+def test_read_large(stlfile_large):
+    pv_mesh = pv.read(stlfile_large)
+
+    points, ind = stl_reader.read(stlfile_large)
+    assert np.array_equal(pv_mesh.points, points)
+    assert np.array_equal(pv_mesh._connectivity_array, ind.ravel())
+
+
+def test_read_threads(stlfile_large):
+    points, ind = stl_reader.read(stlfile_large)
+    points_threaded, ind_threaded = stl_reader.read(stlfile_large, threads=4)
+    assert np.array_equal(points_threaded, points)
+    assert np.array_equal(ind_threaded, ind)
+
+    with pytest.raises(ValueError, match="threads"):
+        stl_reader.read(stlfile_large, threads=0)
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="requires fork")
+def test_read_after_fork(stlfile_large):
+    # reading in forked children after a multi-tile read in the parent must
+    # not hang on a thread pool inherited from the parent, so this runs in a
+    # fresh interpreter regardless of what other tests started
+    script = f"""
+import multiprocessing
+import stl_reader
+
+def read(_):
+    return stl_reader.read({stlfile_large!r})[1].shape
+
+stl_reader.read({stlfile_large!r})
+with multiprocessing.get_context("fork").Pool(2) as pool:
+    print(pool.map_async(read, range(4)).get(timeout=60))
+"""
+    subprocess.run(
+        [sys.executable, "-c", script],
+        env={**os.environ, "OMP_NUM_THREADS": "4"},
+        check=True,
+        timeout=120,
+    )
+
+
+def test_polydata_from_faces_noncontiguous(stlfile):
+    from stl_reader.reader import _polydata_from_faces
+
+    points, ind = stl_reader.read(stlfile)
+    faces = ind.astype(pv.ID_TYPE)[:, ::-1]
+    assert not faces.flags["C_CONTIGUOUS"]
+
+    mesh = _polydata_from_faces(points, faces)
+    assert np.array_equal(mesh.regular_faces, ind[:, ::-1])
+
+
+def test_polydata_from_faces_shares_indices(stlfile):
+    from stl_reader.reader import _polydata_from_faces
+
+    points, ind = stl_reader.read(stlfile)
+    mesh = _polydata_from_faces(points, ind)
+    conn = mesh.GetPolys().GetConnectivityArray()
+    assert conn.GetClassName() == "vtkTypeInt32Array"
+    assert np.shares_memory(pv.convert_array(conn), ind)
+    assert np.array_equal(mesh.regular_faces, ind)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64, np.int32])
+def test_polydata_from_faces_points(stlfile, dtype):
+    from stl_reader.reader import _polydata_from_faces
+
+    points, ind = stl_reader.read(stlfile)
+    points = (points * 10).astype(dtype)
+    mesh = _polydata_from_faces(points, ind)
+    assert np.allclose(mesh.points, points)
+    if dtype != np.int32:
+        assert np.shares_memory(mesh.points, points)
+
+
+@pytest.mark.parametrize("index_dtype", [np.int32, np.int64])
+@pytest.mark.parametrize("fixture", ["stlfile", "stlfile_large"])
+def test_get_stl_data_index_dtype(request, fixture, index_dtype):
+    from stl_reader import _stlfile_wrapper
+
+    stlfile = request.getfixturevalue(fixture)
+    points, ind = stl_reader.read(stlfile)
+    points_typed, ind_typed = _stlfile_wrapper.get_stl_data(stlfile, index_dtype=index_dtype)
+    assert ind_typed.dtype == index_dtype
+    assert np.array_equal(points_typed, points)
+    assert np.array_equal(ind_typed, ind)
+
+    with pytest.raises(ValueError, match="index_dtype"):
+        _stlfile_wrapper.get_stl_data(stlfile, index_dtype=np.float32)